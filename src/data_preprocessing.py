@@ -4,19 +4,23 @@ data_preprocessing.py
 Convert annotated CV JSON data into SpaCy training and validation data.
 
 Steps:
-1. Load annotated JSON file
+1. Stream annotated JSON file
 2. Clean invalid entity spans (trim whitespaces)
 3. Split data into train/test sets
 4. Convert annotations into SpaCy DocBin format
 """
 
-import json
+import hashlib
+import inspect
+import math
 import os
-import re
+import pickle
+from multiprocessing import Pool, cpu_count
+import ijson
+import numpy as np
 from tqdm import tqdm
 from spacy.tokens import DocBin
 import spacy
-from sklearn.model_selection import train_test_split
 
 
 def trim_entity_spans(data: list) -> list:
@@ -27,7 +31,6 @@ def trim_entity_spans(data: list) -> list:
     Returns:
         list: Cleaned data with valid entity spans
     """
-    invalid_span_tokens = re.compile(r'\s')
     cleaned_data = []
 
     for text, annotations in data:
@@ -35,13 +38,10 @@ def trim_entity_spans(data: list) -> list:
         valid_entities = []
 
         for start, end, label in entities:
-            valid_start = start
-            valid_end = end
-
-            while valid_start < len(text) and invalid_span_tokens.match(text[valid_start]):
-                valid_start += 1
-            while valid_end > valid_start and invalid_span_tokens.match(text[valid_end - 1]):
-                valid_end -= 1
+            # str.lstrip/rstrip strip the same characters as the regex \s class
+            span = text[start:end]
+            valid_start = start + len(span) - len(span.lstrip())
+            valid_end = end - (len(span) - len(span.rstrip()))
 
             if valid_start < valid_end:
                 valid_entities.append([valid_start, valid_end, label])
@@ -50,63 +50,163 @@ def trim_entity_spans(data: list) -> list:
     return cleaned_data
 
 
+def stream_train_test_split(input_path: str, test_size: float, random_state: int = 42):
+    """
+    Stream records from a JSON array, trim their spans and bucket them into train/test.
+    Gives the same split as sklearn's train_test_split(..., random_state=random_state)
+    without loading the whole file at once.
+    Returns:
+        tuple: (train, test) lists of cleaned (text, annotations) pairs
+    """
+    # First pass: count records
+    with open(input_path, "rb") as f:
+        n_samples = sum(1 for _ in ijson.items(f, "item"))
+
+    n_test = math.ceil(test_size * n_samples)
+    permutation = np.random.RandomState(random_state).permutation(n_samples)
+    rank = np.empty(n_samples, dtype=np.int64)
+    rank[permutation] = np.arange(n_samples)
+
+    # Second pass: trim and bucket each record by its position in the permutation
+    train, test = [], []
+    with open(input_path, "rb") as f:
+        records = ijson.items(f, "item", use_float=True)
+        for idx, record in enumerate(tqdm(records, total=n_samples, desc="Cleaning entity spans")):
+            position = int(rank[idx])
+            bucket = test if position < n_test else train
+            bucket.append((position, trim_entity_spans([record])[0]))
+
+    train.sort(key=lambda item: item[0])
+    test.sort(key=lambda item: item[0])
+    return [record for _, record in train], [record for _, record in test]
+
+
+_nlp = None
+
+
+def _init_nlp():
+    """Build the blank SpaCy pipeline once per worker process."""
+    global _nlp
+    _nlp = spacy.blank("en")
+
+
+def _build_doc(pair) -> tuple:
+    """
+    Convert one (text, annotations) pair into a serialized single-doc DocBin.
+    Returns:
+        tuple: (DocBin bytes, list of invalid span messages)
+    """
+    text, annot = pair
+    doc = _nlp.make_doc(text)
+    ents = []
+    errors = []
+    occupied = bytearray(len(text))  # 1 for every character already covered by an entity
+
+    for start, end, label in annot["entities"]:
+        if occupied.find(1, start, end) != -1:
+            continue
+        occupied[start:end] = b"\x01" * (end - start)
+        span = doc.char_span(start, end, label=label, alignment_mode="strict")
+        if span is not None:
+            ents.append(span)
+        else:
+            errors.append(f"Invalid span: {start}-{end} in text: {text[:60]}...\n")
+
+    doc.ents = ents
+    db = DocBin(store_user_data=False)
+    db.add(doc)
+    return db.to_bytes(), errors
+
+
 def convert_to_spacy(data, output_path: str, error_log="error.txt"):
     """
-    Convert (text, annotations) into SpaCy DocBin format.
+    Convert (text, annotations) into SpaCy DocBin format, one worker per CPU.
     """
-    nlp = spacy.blank("en")
-    db = DocBin()
-    file = open(error_log, "w")
-
-    for text, annot in tqdm(data, desc="Converting to SpaCy format"):
-        doc = nlp.make_doc(text)
-        ents = []
-        entity_indices = []
-
-        for start, end, label in annot["entities"]:
-            if any(idx in entity_indices for idx in range(start, end)):
-                continue
-            entity_indices.extend(list(range(start, end)))
-            span = doc.char_span(start, end, label=label, alignment_mode="strict")
-            if span is not None:
-                ents.append(span)
-            else:
-                file.write(f"Invalid span: {start}-{end} in text: {text[:60]}...\n")
-
-        doc.ents = ents
-        db.add(doc)
-
-    db.to_disk(output_path)
-    file.close()
+    merged = DocBin(store_user_data=False)
+    errors = []
+
+    try:
+        with Pool(cpu_count(), initializer=_init_nlp) as pool:
+            results = pool.imap(_build_doc, data, chunksize=64)
+            for buf, doc_errors in tqdm(results, total=len(data), desc="Converting to SpaCy format"):
+                merged.merge(DocBin(store_user_data=False).from_bytes(buf))
+                errors.extend(doc_errors)
+        merged.to_disk(output_path)
+    finally:
+        with open(error_log, "w") as f:
+            f.writelines(errors)
     print(f"✅ Saved SpaCy DocBin to: {output_path}")
 
 
+def _split_cache_key(input_path: str, test_size: float, random_state: int) -> str:
+    """
+    Key for the cached (train, test) split. Changes whenever the input file,
+    the split parameters or the cleaning/splitting code changes.
+    """
+    code = inspect.getsource(trim_entity_spans) + inspect.getsource(stream_train_test_split)
+    raw = (
+        f"{os.path.getmtime(input_path)}-{os.path.getsize(input_path)}"
+        f"-{test_size}-{random_state}-{code}"
+    )
+    return hashlib.blake2b(raw.encode()).hexdigest()[:16]
+
+
 def main():
     # === Configuration ===
     input_path = "./data/final_fix_transformed.json"
     output_dir = "./corpus"
     test_size = 0.2
+    random_state = 42
+
+    train_path = os.path.join(output_dir, "train_data.spacy")
+    test_path = os.path.join(output_dir, "test_data.spacy")
+    stamp_path = os.path.join(output_dir, ".split_key")  # Split key the DocBins were built from
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # === Load Data ===
-    print("📥 Loading dataset...")
-    with open(input_path, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
-
-    # === Clean Entity Spans ===
-    print("🧹 Cleaning entity spans...")
-    cleaned_data = trim_entity_spans(raw_data)
-
-    # === Train-Test Split ===
-    print("✂️ Splitting dataset...")
-    train, test = train_test_split(cleaned_data, test_size=test_size, random_state=42)
+    # === Skip if DocBins are newer than the input JSON and built with the same split ===
+    split_key = _split_cache_key(input_path, test_size, random_state)
+    input_mtime = os.path.getmtime(input_path)
+    docbins_fresh = all(
+        os.path.exists(p) and os.path.getmtime(p) > input_mtime for p in (train_path, test_path)
+    )
+    if docbins_fresh and os.path.exists(stamp_path):
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            if f.read().strip() == split_key:
+                print("✅ Corpus up-to-date, skipping.")
+                return
+
+    # === Stream, Clean Entity Spans & Split (cached across runs) ===
+    cache_dir = os.path.join(output_dir, ".cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_name = f"{split_key}.pkl"
+    cache_path = os.path.join(cache_dir, cache_name)
+
+    if os.path.exists(cache_path):
+        print(f"♻️ Loading cleaned train/test split from cache: {cache_path}")
+        with open(cache_path, "rb") as f:
+            train, test = pickle.load(f)
+    else:
+        print("📥 Streaming dataset, cleaning entity spans and splitting...")
+        train, test = stream_train_test_split(input_path, test_size=test_size, random_state=random_state)
+        # Write to a temp file first so an interrupted run never leaves a truncated cache
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((train, test), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+
+        # Drop splits cached for older inputs or settings
+        for name in os.listdir(cache_dir):
+            if name != cache_name:
+                os.remove(os.path.join(cache_dir, name))
 
     # === Convert to SpaCy format ===
     print("💾 Converting to SpaCy DocBin format...")
-    convert_to_spacy(train, os.path.join(output_dir, "train_data.spacy"))
-    convert_to_spacy(test, os.path.join(output_dir, "test_data.spacy"))
+    convert_to_spacy(train, train_path)
+    convert_to_spacy(test, test_path)
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        f.write(split_key)
 
     print("\n✅ Data preprocessing completed successfully!")
 
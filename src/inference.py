@@ -5,61 +5,290 @@ Performs Named Entity Recognition (NER) inference on PDF CV files and optionally
 analyzes candidate-job fit using a Large Language Model (Gemini via OpenRouter).
 
 Dependencies:
-    pip install spacy spacy-transformers PyMuPDF requests pandas
+    pip install spacy spacy-transformers PyMuPDF requests httpx orjson openai diskcache pandas
+    pip install deepsparse  # optional, only for USE_DEEPSPARSE=1
+
+Set NER_THREADS to tune CPU threads for inference (default: min(4, CPU count)).
 """
 
+import os
+
+# Thread pools are sized at import time, so this must run before torch/spacy load
+NER_THREADS = int(os.getenv("NER_THREADS", min(4, os.cpu_count() or 1)))
+os.environ.setdefault("OMP_NUM_THREADS", str(NER_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(NER_THREADS))
+
 import fitz
 import spacy
+import argparse
+import asyncio
+import diskcache
+import functools
+import hashlib
 import json
+import httpx
+import orjson
 import pandas as pd
 import requests
-import os
+import time
+import torch
+from openai import OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import List, Tuple
 
 # === Configuration ===
 MODEL_PATH = "./output/model-last"
 PDF_PATH = "./examples/sample_cv.pdf"
 OUTPUT_JSON = "./examples/sample_output.json"
 USE_LLM_ANALYSIS = True  # Set False if you only want NER extraction
+INTERACTIVE = True  # Set False to score through the OpenAI Batch API (cheaper, <24h turnaround)
+DEFAULT_JOB_POSITION = "Staff Divisi Sponsor"
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")  # Securely load from env
 MODEL_NAME = "google/gemini-2.5-flash-preview-05-20"
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+LLM_CONCURRENCY = 10  # Max in-flight OpenRouter requests in score_many
+LLM_MAX_RETRIES = 3
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+LLM_CACHE_DIR = "./.llm_cache"  # Persistent cache of recruiter summaries
+LLM_CACHE_TTL = 30 * 86400  # Seconds a cached summary stays valid
+BATCH_MODEL_NAME = os.getenv("BATCH_MODEL_NAME", "gpt-4o-mini")  # OPENAI_API_KEY is read from env
+BATCH_INPUT_JSONL = "./examples/batch_input.jsonl"
+BATCH_POLL_INTERVAL = 60  # Seconds between batch status checks
+NER_BATCH_SIZE = 32  # Number of pages per nlp.pipe batch
+QUANTIZE_INT8 = False  # Set True to run the transformer with INT8 weights on CPU
+USE_DEEPSPARSE = os.getenv("USE_DEEPSPARSE", "0") == "1"  # Sparse CPU pipeline instead of SpaCy
+# Pruned+quantized checkpoint; replace with the SparseML model fine-tuned on the CV labels
+DEEPSPARSE_MODEL_PATH = os.getenv(
+    "DEEPSPARSE_MODEL_PATH",
+    "zoo:nlp/token_classification/distilbert-none/pytorch/huggingface/conll2003/pruned80_quant-none-vnni",
+)
+DEEPSPARSE_BATCH_SIZE = 8
+# DeepSparse truncates each input at this many tokens, so pages are split into windows that fit
+DEEPSPARSE_SEQUENCE_LENGTH = 128
+NER_CACHE_SIZE = 128  # Max number of distinct CVs whose NER results are kept in memory
+
+if not QUANTIZE_INT8:
+    spacy.prefer_gpu()  # INT8 quantized layers only run on CPU
+torch.set_num_threads(NER_THREADS)
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    pass  # Torch already ran parallel work in this process (e.g. imported from a notebook)
+
+_NL_TO_SPACE = str.maketrans({"\n": " ", "\r": " ", "\t": " "})
+
+_session = requests.Session()
+_session.headers.update({
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json",
+})
+_session.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=LLM_MAX_RETRIES,
+        backoff_factor=1,
+        status_forcelist=sorted(RETRY_STATUS_CODES),
+        allowed_methods=frozenset({"POST"}),
+    ),
+))
+
+_ner_cache = {}
+_ner_cache_stats = {"hits": 0, "misses": 0}
 
 
 # ------------------------- Utility Functions -------------------------
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text from PDF using PyMuPDF."""
+def extract_text_from_pdf(pdf_path: str) -> Tuple[List[str], List[int]]:
+    """
+    Extract per-page text from PDF using PyMuPDF.
+    Returns:
+        tuple: (pages, offsets) where offsets[i] is the character position of
+        pages[i] within the concatenated CV text.
+    """
     print(f"📄 Extracting text from: {pdf_path}")
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    text = " ".join(text.split("\n"))
-    return text
+    pages, offsets = [], []
+    cursor = 0
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            page_text = page.get_text("text")
+            if not page_text.strip():
+                continue  # Skip empty or graphics-only pages
+            page_text = page_text.translate(_NL_TO_SPACE)
+            pages.append(page_text)
+            offsets.append(cursor)
+            cursor += len(page_text)
+    return pages, offsets
+
+
+def quantize_transformer(nlp):
+    """
+    Apply dynamic INT8 quantization to the transformer's Linear layers (CPU only).
+    LayerNorm, GELU, Softmax and embedding lookups stay in FP32 to preserve accuracy.
+    """
+    trf = nlp.get_pipe("transformer")
+    hf_model = trf.model.layers[0].shims[0]._model
+    hf_model.to("cpu")
+    torch.quantization.quantize_dynamic(
+        hf_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    return nlp
 
 
-def perform_ner_inference(model_path: str, text: str):
-    """Run SpaCy NER model on input text."""
+@functools.lru_cache(maxsize=2)
+def _load_nlp(model_path: str):
+    """Load (and optionally quantize) a SpaCy model once per path."""
     print("🧠 Loading NER model...")
+    if QUANTIZE_INT8:
+        # Quantized Linear layers are CPU-only, so keep thinc from feeding them CUDA tensors
+        spacy.require_cpu()
     nlp = spacy.load(model_path)
-    doc = nlp(text)
+    if QUANTIZE_INT8:
+        print("⚙️ Quantizing transformer to INT8...")
+        nlp = quantize_transformer(nlp)
+    return nlp
+
+
+@functools.lru_cache(maxsize=2)
+def _load_deepsparse(model_path: str):
+    """Create a DeepSparse NER pipeline once per model path."""
+    from deepsparse import Pipeline
+
+    print("🧠 Loading DeepSparse NER pipeline...")
+    return Pipeline.create(
+        task="ner",
+        model_path=model_path,
+        batch_size=DEEPSPARSE_BATCH_SIZE,
+        sequence_length=DEEPSPARSE_SEQUENCE_LENGTH,
+        aggregation_strategy="simple",
+    )
 
-    print(f"🔍 Detected {len(doc.ents)} entities.\n")
-    entities = [{"Text": ent.text, "Label": ent.label_} for ent in doc.ents]
 
-    # Convert to JSON-like structure
-    ner_json = [
-        [ent.text, {"entities": [[ent.start_char, ent.end_char, ent.label_]]}]
-        for ent in doc.ents
-    ]
+def _text_hash(model_path: str, pages: List[str]) -> str:
+    """Short digest identifying a (model, CV text) pair."""
+    digest = hashlib.blake2b(model_path.encode())
+    for page in pages:
+        digest.update(b"\x00" + page.encode())
+    return digest.hexdigest()[:16]
+
+
+def _ner_predict(text_hash: str, predict):
+    """Return the cached NER result for text_hash, or compute and cache it."""
+    if text_hash in _ner_cache:
+        _ner_cache_stats["hits"] += 1
+        print("♻️ Reusing cached NER result.")
+        return _ner_cache[text_hash]
+
+    _ner_cache_stats["misses"] += 1
+    result = predict()
+    if len(_ner_cache) >= NER_CACHE_SIZE:
+        _ner_cache.pop(next(iter(_ner_cache)))
+    _ner_cache[text_hash] = result
+    return result
+
+
+def cache_stats() -> dict:
+    """Report hit/miss counts of the model and NER result caches."""
+    return {
+        "ner_hits": _ner_cache_stats["hits"],
+        "ner_misses": _ner_cache_stats["misses"],
+        "ner_entries": len(_ner_cache),
+        "models_loaded": _load_nlp.cache_info().currsize + _load_deepsparse.cache_info().currsize,
+    }
 
+
+def clear_cache():
+    """Drop cached models and NER results."""
+    _load_nlp.cache_clear()
+    _load_deepsparse.cache_clear()
+    _ner_cache.clear()
+    _ner_cache_stats.update(hits=0, misses=0)
+
+
+def perform_ner_inference(model_path: str, pages: List[str], offsets: List[int]):
+    """
+    Run SpaCy NER model on CV pages in batches via nlp.pipe.
+    Entity offsets are shifted back to absolute positions in the full text.
+    """
+    return _ner_predict(
+        _text_hash(model_path, pages),
+        lambda: _spacy_predict(_load_nlp(model_path), pages, offsets),
+    )
+
+
+def _spacy_predict(nlp, pages: List[str], offsets: List[int]):
+    docs = list(nlp.pipe(pages, batch_size=NER_BATCH_SIZE, n_process=1))
+
+    entities, ner_json = [], []
+    for page_idx, doc in enumerate(docs):
+        offset = offsets[page_idx]
+        for ent in doc.ents:
+            entities.append({"Text": ent.text, "Label": ent.label_})
+            # Convert to JSON-like structure
+            ner_json.append(
+                [ent.text, {"entities": [[ent.start_char + offset, ent.end_char + offset, ent.label_]]}]
+            )
+
+    print(f"🔍 Detected {len(entities)} entities.\n")
     return entities, ner_json
 
 
-def get_recruiter_summary(job_position: str, ner_results: list) -> str:
+def perform_deepsparse_inference(model_path: str, pages: List[str], offsets: List[int]):
     """
-    Sends NER results to OpenRouter API for recruiter-style evaluation.
-    Returns a critical, formatted suitability summary.
+    Run a sparsified token-classification model with DeepSparse on CV pages.
+    Returns the same (entities, ner_json) structure as perform_ner_inference.
     """
+    return _ner_predict(
+        _text_hash(model_path, pages),
+        lambda: _deepsparse_predict(_load_deepsparse(model_path), pages, offsets),
+    )
+
+
+def _token_windows(tokenizer, text: str, max_tokens: int) -> List[Tuple[int, str]]:
+    """
+    Split text into (char_start, window) pieces of at most max_tokens tokens.
+    Windows are cut before a token that starts a new word where possible.
+    """
+    spans = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    windows = []
+    first = 0
+    while first < len(spans):
+        last = min(first + max_tokens, len(spans))
+        while last < len(spans) and last > first + 1 and not text[spans[last][0] - 1].isspace():
+            last -= 1
+        start = spans[first][0]
+        end = spans[last][0] if last < len(spans) else len(text)
+        windows.append((start, text[start:end]))
+        first = last
+    return windows
+
+
+def _deepsparse_predict(pipeline, pages: List[str], offsets: List[int]):
+    # Leave room for the [CLS]/[SEP] special tokens
+    max_tokens = DEEPSPARSE_SEQUENCE_LENGTH - 2
+    windows, window_offsets = [], []
+    for page, offset in zip(pages, offsets):
+        for start, window in _token_windows(pipeline.tokenizer, page, max_tokens):
+            windows.append(window)
+            window_offsets.append(offset + start)
+
+    entities, ner_json = [], []
+    predictions_per_window = pipeline(inputs=windows).predictions if windows else []
+    for window, offset, predictions in zip(windows, window_offsets, predictions_per_window):
+        for pred in predictions:
+            text = window[pred.start:pred.end]
+            entities.append({"Text": text, "Label": pred.entity})
+            ner_json.append(
+                [text, {"entities": [[pred.start + offset, pred.end + offset, pred.entity]]}]
+            )
+
+    print(f"🔍 Detected {len(entities)} entities.\n")
+    return entities, ner_json
+
+
+def _build_recruiter_payload(job_position: str, ner_results: list) -> dict:
+    """Build the OpenRouter chat-completion payload for one CV."""
     system_prompt = """
 Peran: Anda adalah seorang Asisten AI Rekruter senior yang kritis.
 Tugas: Evaluasi kesesuaian kandidat terhadap posisi kerja berdasarkan JSON hasil NER.
@@ -71,15 +300,10 @@ Kandidat [Nama] dinilai COCOK/DAPAT DIPERTIMBANGKAN/TIDAK COCOK untuk posisi {po
     user_prompt = f"""
 Posisi yang dilamar: {job_position}
 JSON Entitas:
-{json.dumps(ner_results, indent=2, ensure_ascii=False)}
+{orjson.dumps(ner_results).decode()}
 """
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    payload = {
+    return {
         "model": MODEL_NAME,
         "messages": [
             {"role": "system", "content": system_prompt},
@@ -87,26 +311,197 @@ JSON Entitas:
         ],
     }
 
+
+@functools.lru_cache(maxsize=1)
+def _llm_cache() -> diskcache.Cache:
+    """Open the recruiter summary cache on first use."""
+    return diskcache.Cache(LLM_CACHE_DIR)
+
+
+def _summary_cache_key(job_position: str, ner_results: list) -> str:
+    """Key a recruiter summary by LLM model, job position and canonical NER JSON."""
+    raw = b"\x00".join([
+        MODEL_NAME.encode(),
+        job_position.encode(),
+        orjson.dumps(ner_results, option=orjson.OPT_SORT_KEYS),
+    ])
+    return hashlib.sha256(raw).hexdigest()
+
+
+def get_recruiter_summary(job_position: str, ner_results: list, use_cache: bool = True) -> str:
+    """
+    Sends NER results to OpenRouter API for recruiter-style evaluation.
+    Returns a critical, formatted suitability summary.
+    Successful summaries are cached on disk unless use_cache is False.
+    """
+    key = _summary_cache_key(job_position, ner_results)
+    cached = _llm_cache().get(key) if use_cache else None
+    if cached is not None:
+        print("♻️ Reusing cached recruiter analysis.")
+        return cached
+
+    payload = _build_recruiter_payload(job_position, ner_results)
+
     try:
         print("🧩 Calling OpenRouter API for recruiter analysis...")
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload),
+        response = _session.post(
+            OPENROUTER_URL,
+            data=orjson.dumps(payload),
             timeout=60,
         )
         response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
+        result = orjson.loads(response.content)
+        summary = result["choices"][0]["message"]["content"]
     except Exception as e:
         return f"❌ Error during recruiter summary generation: {e}"
 
+    if use_cache:
+        _llm_cache().set(key, summary, expire=LLM_CACHE_TTL)
+    return summary
+
+
+async def get_recruiter_summary_async(
+    session: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    job_position: str,
+    ner_results: list,
+    use_cache: bool = True,
+) -> str:
+    """
+    Async variant of get_recruiter_summary sharing one client and a concurrency limit.
+    Retries with exponential backoff on 429/5xx responses, timeouts and connection errors.
+    """
+    key = _summary_cache_key(job_position, ner_results)
+    cached = _llm_cache().get(key) if use_cache else None
+    if cached is not None:
+        return cached
+
+    payload = _build_recruiter_payload(job_position, ner_results)
+    error = None
+
+    async with sem:
+        for attempt in range(LLM_MAX_RETRIES):
+            try:
+                response = await session.post(OPENROUTER_URL, content=orjson.dumps(payload))
+                response.raise_for_status()
+                result = orjson.loads(response.content)
+                summary = result["choices"][0]["message"]["content"]
+                if use_cache:
+                    _llm_cache().set(key, summary, expire=LLM_CACHE_TTL)
+                return summary
+            except httpx.HTTPStatusError as e:
+                error = e
+                if e.response.status_code not in RETRY_STATUS_CODES:
+                    break
+            except httpx.TransportError as e:  # Timeouts, connection resets, ConnectError
+                error = e
+            except Exception as e:
+                error = e
+                break
+            if attempt < LLM_MAX_RETRIES - 1:
+                await asyncio.sleep(2 ** attempt)
+
+    return f"❌ Error during recruiter summary generation: {error}"
+
+
+async def score_many(cvs: List[Tuple[str, list]], use_cache: bool = True) -> List[str]:
+    """
+    Score many (job_position, ner_results) pairs concurrently.
+    Returns summaries in the same order as the input. Usage:
+        summaries = asyncio.run(score_many(cvs))
+    """
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    sem = asyncio.Semaphore(LLM_CONCURRENCY)
+
+    print(f"🧩 Scoring {len(cvs)} CVs via OpenRouter (max {LLM_CONCURRENCY} concurrent)...")
+    async with httpx.AsyncClient(headers=headers, timeout=60) as session:
+        return await asyncio.gather(
+            *[get_recruiter_summary_async(session, sem, job, ner, use_cache) for job, ner in cvs]
+        )
+
+
+def submit_batch_recruiter(cv_ner_list: List[Tuple[str, list]], job_position: str) -> str:
+    """
+    Submit (cv_id, ner_results) pairs as one OpenAI Batch API job.
+    Returns the batch ID to pass to poll_batch.
+    """
+    client = OpenAI()
+
+    with open(BATCH_INPUT_JSONL, "wb") as f:
+        for cv_id, ner_results in cv_ner_list:
+            body = _build_recruiter_payload(job_position, ner_results)
+            body["model"] = BATCH_MODEL_NAME
+            request = {
+                "custom_id": str(cv_id),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }
+            f.write(orjson.dumps(request) + b"\n")
+
+    print(f"📦 Uploading {len(cv_ner_list)} requests to the Batch API...")
+    with open(BATCH_INPUT_JSONL, "rb") as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"✅ Submitted batch: {batch.id}")
+    return batch.id
+
+
+def poll_batch(batch_id: str, poll_interval: int = BATCH_POLL_INTERVAL) -> dict:
+    """
+    Wait for a Batch API job to finish and parse its output.
+    Returns a {cv_id: summary} mapping.
+    """
+    client = OpenAI()
+
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            break
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} ended with status: {batch.status}")
+        print(f"⏳ Batch {batch_id} is {batch.status}, checking again in {poll_interval}s...")
+        time.sleep(poll_interval)
+
+    # Successful requests land in output_file_id, failed ones may only appear in error_file_id;
+    # either can be None when every request ended up in the other file
+    summaries = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id is None:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body")
+                summaries[record["custom_id"]] = f"❌ Error during recruiter summary generation: {error}"
+            else:
+                body = response["body"]
+                summaries[record["custom_id"]] = body["choices"][0]["message"]["content"]
+    return summaries
+
 
 # ------------------------- Main Execution -------------------------
 
 def main():
-    text = extract_text_from_pdf(PDF_PATH)
-    entities, ner_json = perform_ner_inference(MODEL_PATH, text)
+    parser = argparse.ArgumentParser(description="NER inference and recruiter analysis on a CV PDF.")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the recruiter summary cache")
+    args = parser.parse_args()
+
+    pages, offsets = extract_text_from_pdf(PDF_PATH)
+    if USE_DEEPSPARSE:
+        entities, ner_json = perform_deepsparse_inference(DEEPSPARSE_MODEL_PATH, pages, offsets)
+    else:
+        entities, ner_json = perform_ner_inference(MODEL_PATH, pages, offsets)
 
     # Save structured output
     with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
@@ -119,8 +514,14 @@ def main():
     print(df.head(15))
 
     if USE_LLM_ANALYSIS:
-        job_position = input("\nMasukkan posisi yang dilamar: ") or "Staff Divisi Sponsor"
-        summary = get_recruiter_summary(job_position, ner_json)
+        if INTERACTIVE:
+            job_position = input("\nMasukkan posisi yang dilamar: ") or DEFAULT_JOB_POSITION
+            summary = get_recruiter_summary(job_position, ner_json, use_cache=not args.no_cache)
+        else:
+            batch_id = submit_batch_recruiter([(PDF_PATH, ner_json)], DEFAULT_JOB_POSITION)
+            summary = poll_batch(batch_id).get(
+                PDF_PATH, "❌ Error during recruiter summary generation: no result returned by batch"
+            )
         print("\n--- HASIL ANALISIS KESESUAIAN KANDIDAT ---")
         print(summary)
 
@@ -0,0 +1,58 @@
+import random
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from data_preprocessing import trim_entity_spans  # noqa: E402
+
+
+def _regex_trim(text, start, end):
+    """Reference implementation: the original per-character regex loops."""
+    invalid_span_tokens = re.compile(r'\s')
+    valid_start, valid_end = start, end
+    while valid_start < len(text) and invalid_span_tokens.match(text[valid_start]):
+        valid_start += 1
+    while valid_end > valid_start and invalid_span_tokens.match(text[valid_end - 1]):
+        valid_end -= 1
+    return [valid_start, valid_end] if valid_start < valid_end else None
+
+
+def _trimmed(text, start, end, label="SKILL"):
+    return trim_entity_spans([[text, {"entities": [[start, end, label]]}]])[0][1]["entities"]
+
+
+def test_strips_leading_and_trailing_whitespace():
+    assert _trimmed("  Python \n", 0, 10) == [[2, 8, "SKILL"]]
+
+
+def test_keeps_inner_whitespace():
+    assert _trimmed("Data Science", 0, 12) == [[0, 12, "SKILL"]]
+
+
+def test_drops_empty_span():
+    assert _trimmed("Python", 3, 3) == []
+
+
+@pytest.mark.parametrize("text", [" ", "\t\n ", "\xa0 "])
+def test_drops_all_whitespace_span(text):
+    assert _trimmed(text, 0, len(text)) == []
+
+
+def test_keeps_text_and_labels():
+    data = [["  Jakarta ", {"entities": [[0, 10, "LOC"]]}]]
+    assert trim_entity_spans(data) == [["  Jakarta ", {"entities": [[2, 9, "LOC"]]}]]
+
+
+def test_matches_regex_loops_on_random_spans():
+    rng = random.Random(0)
+    alphabet = [" ", "\t", "\n", "\r", "\xa0", " ", "a", "B", "7", "."]
+    for _ in range(20000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, len(text))
+        expected = _regex_trim(text, start, end)
+        assert _trimmed(text, start, end) == ([expected + ["SKILL"]] if expected else [])